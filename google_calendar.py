@@ -1,13 +1,16 @@
+from __future__ import annotations
+
 import argparse
+import json
+import re
 import sys
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
 
 # Scopes needed to create/update calendar events for the signed-in user
@@ -15,6 +18,29 @@ GOOGLE_SCOPES = [
     "https://www.googleapis.com/auth/calendar",
 ]
 
+# Built Calendar services keyed by (client_secrets, token_file), so repeated
+# upserts in one process reuse the discovery document and HTTP session
+_SERVICE_CACHE: Dict[Tuple[str, str], Any] = {}
+# Credentials behind each cached service, for starting a refresh timer later
+_CREDS_CACHE: Dict[Tuple[str, str], Credentials] = {}
+
+# Maximum number of calls Google accepts in a single batch request
+GOOGLE_BATCH_SIZE = 50
+
+# Refresh access tokens this long before they expire
+REFRESH_MARGIN = timedelta(minutes=5)
+# Delay before retrying a failed background refresh
+REFRESH_RETRY_DELAY = timedelta(minutes=1)
+# Serializes token refreshes between callers and the background timer
+_REFRESH_LOCK = threading.Lock()
+# Token files that already have a background refresh timer
+_REFRESH_SCHEDULED: Set[Path] = set()
+
+# Shape of the ISO 8601 datetimes accepted for --start/--end
+_ISO_RE = re.compile(
+    r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})?", re.ASCII
+)
+
 
 def build_event_payload(
     summary: str,
@@ -25,10 +51,10 @@ def build_event_payload(
     location: Optional[str],
 ) -> Dict[str, Any]:
     for label, value in (("start", start), ("end", end)):
-        try:
-            datetime.fromisoformat(value)
-        except ValueError as err:
-            raise SystemExit(f"Invalid {label} datetime '{value}': {err}")
+        if not _ISO_RE.fullmatch(value):
+            raise SystemExit(
+                f"Invalid {label} datetime '{value}': expected YYYY-MM-DDTHH:MM:SS"
+            )
 
     event: Dict[str, Any] = {
         "summary": summary,
@@ -42,24 +68,126 @@ def build_event_payload(
     return event
 
 
+def needs_refresh(creds: Credentials) -> bool:
+    """Whether creds are invalid or within REFRESH_MARGIN of their expiry."""
+
+    if not creds.valid:
+        return True
+    if creds.expiry is None:
+        return False
+    # google-auth stores expiry as a naive UTC datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now < REFRESH_MARGIN
+
+
 def load_credentials(client_secrets_path: Path, token_path: Path) -> Credentials:
+    # The google client libraries are slow to import; load them only when used
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds: Optional[Credentials] = None
     if token_path.exists():
         creds = Credentials.from_authorized_user_file(str(token_path), GOOGLE_SCOPES)
-    # Refresh or start a new flow if needed
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+    loaded_token = creds.token if creds else None
+
+    if creds and creds.refresh_token and needs_refresh(creds):
+        # Refresh ahead of expiry so calls don't race the server-side deadline
+        with _REFRESH_LOCK:
             creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                str(client_secrets_path), GOOGLE_SCOPES
-            )
-            # Use console-based flow to keep this non-interactive friendly
-            creds = flow.run_console()
+    elif not creds or not creds.valid:
+        flow = InstalledAppFlow.from_client_secrets_file(
+            str(client_secrets_path), GOOGLE_SCOPES
+        )
+        # Use console-based flow to keep this non-interactive friendly
+        creds = flow.run_console()
+
+    if creds.token != loaded_token:
         token_path.write_text(creds.to_json())
     return creds
 
 
+def start_background_refresh(creds: Credentials, token_path: Path) -> None:
+    """Keep creds fresh from a daemon timer, REFRESH_MARGIN before each expiry.
+
+    Meant for long-running processes, so that the refresh round-trip happens
+    off the request path. Each refresh rewrites token_path and reschedules.
+    At most one timer is started per token file; it stops if Google rejects
+    the refresh token.
+    """
+
+    from google.auth.exceptions import RefreshError
+    from google.auth.transport.requests import Request
+
+    with _REFRESH_LOCK:
+        if token_path in _REFRESH_SCHEDULED:
+            return
+        _REFRESH_SCHEDULED.add(token_path)
+
+    def refresh() -> None:
+        try:
+            with _REFRESH_LOCK:
+                creds.refresh(Request())
+                token_path.write_text(creds.to_json())
+        except RefreshError as err:
+            # Revoked or expired refresh token: retrying can't succeed
+            print(f"Background token refresh stopped: {err}", file=sys.stderr)
+            stop()
+            return
+        except Exception as err:
+            print(f"Background token refresh failed: {err}", file=sys.stderr)
+            schedule(REFRESH_RETRY_DELAY.total_seconds())
+            return
+        schedule_before_expiry()
+
+    def schedule(delay: float) -> None:
+        timer = threading.Timer(delay, refresh)
+        timer.daemon = True
+        timer.start()
+
+    def stop() -> None:
+        with _REFRESH_LOCK:
+            _REFRESH_SCHEDULED.discard(token_path)
+
+    def schedule_before_expiry() -> None:
+        if creds.expiry is None:
+            # Token without an expiry: nothing to schedule
+            stop()
+            return
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        schedule(max((creds.expiry - now - REFRESH_MARGIN).total_seconds(), 0))
+
+    schedule_before_expiry()
+
+
+def get_service(
+    client_secrets: str, token_file: str, background_refresh: bool = False
+) -> Any:
+    """Return the Calendar service for these credentials, building it once.
+
+    With background_refresh, long-running callers also get a timer that
+    refreshes the token before it expires (see start_background_refresh).
+    """
+
+    key = (client_secrets, token_file)
+    if key not in _SERVICE_CACHE:
+        from googleapiclient.discovery import build
+
+        creds = load_credentials(Path(client_secrets), Path(token_file))
+        _CREDS_CACHE[key] = creds
+        _SERVICE_CACHE[key] = build(
+            "calendar",
+            "v3",
+            credentials=creds,
+            cache_discovery=False,
+            static_discovery=True,
+        )
+    creds = _CREDS_CACHE[key]
+    if background_refresh and creds.refresh_token:
+        start_background_refresh(creds, Path(token_file))
+    return _SERVICE_CACHE[key]
+
+
 def upsert_event(
     client_secrets: str,
     token_file: str,
@@ -72,8 +200,7 @@ def upsert_event(
     location: Optional[str],
     event_id: Optional[str],
 ) -> Dict[str, Any]:
-    creds = load_credentials(Path(client_secrets), Path(token_file))
-    service = build("calendar", "v3", credentials=creds)
+    service = get_service(client_secrets, token_file)
 
     payload = build_event_payload(
         summary=summary,
@@ -96,6 +223,79 @@ def upsert_event(
     return result
 
 
+def upsert_events_bulk(
+    client_secrets: str,
+    token_file: str,
+    calendar_id: str,
+    payloads: List[Tuple[Optional[str], Dict[str, Any]]],
+) -> List[Any]:
+    """Create or update many events using batched HTTP requests.
+
+    Each item is an ``(event_id, payload)`` pair; a ``None`` event id creates
+    the event, otherwise the existing event is patched. Returns one entry per
+    item, in order: the API result dict, or the exception raised for that call
+    (or for its whole batch).
+    """
+
+    service = get_service(client_secrets, token_file)
+    results: List[Any] = [None] * len(payloads)
+
+    def callback(request_id: str, response: Any, exception: Any) -> None:
+        results[int(request_id)] = exception if exception is not None else response
+
+    for offset in range(0, len(payloads), GOOGLE_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=callback)
+        chunk = payloads[offset : offset + GOOGLE_BATCH_SIZE]
+        for index, (event_id, payload) in enumerate(chunk, start=offset):
+            if event_id:
+                request = service.events().patch(
+                    calendarId=calendar_id, eventId=event_id, body=payload
+                )
+            else:
+                request = service.events().insert(calendarId=calendar_id, body=payload)
+            batch.add(request, request_id=str(index))
+        try:
+            batch.execute()
+        except Exception as err:
+            # The whole batch failed (network, auth, HTTP error on the batch
+            # itself): blame every call in it that has no result yet, and keep
+            # going so callers still learn the outcome of the other batches
+            for index in range(offset, offset + len(chunk)):
+                if results[index] is None:
+                    results[index] = err
+
+    return results
+
+
+def load_events_file(
+    path: str, default_timezone: str
+) -> List[Tuple[Optional[str], Dict[str, Any]]]:
+    """Read a JSON array of events using the same keys as the CLI flags."""
+
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise SystemExit(f"Events file '{path}' must contain a JSON array")
+
+    payloads: List[Tuple[Optional[str], Dict[str, Any]]] = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise SystemExit(f"Event #{i} in '{path}' must be a JSON object")
+        title = entry.get("title") or entry.get("summary")
+        if not title or "start" not in entry or "end" not in entry:
+            raise SystemExit(f"Event #{i} in '{path}' needs title, start and end")
+        payload = build_event_payload(
+            summary=title,
+            start=entry["start"],
+            end=entry["end"],
+            timezone=entry.get("timezone") or default_timezone,
+            description=entry.get("description"),
+            location=entry.get("location"),
+        )
+        payloads.append((entry.get("event_id"), payload))
+    return payloads
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Create or update a Google Calendar event (delegated OAuth)"
@@ -118,11 +318,9 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--title", help="Event title/summary")
     parser.add_argument("--description", help="Optional description")
     parser.add_argument(
-        "--start", required=True, help="Local start datetime, e.g. 2025-10-17T09:00:00"
-    )
-    parser.add_argument(
-        "--end", required=True, help="Local end datetime, e.g. 2025-10-17T10:00:00"
+        "--start", help="Local start datetime, e.g. 2025-10-17T09:00:00"
     )
+    parser.add_argument("--end", help="Local end datetime, e.g. 2025-10-17T10:00:00")
     parser.add_argument(
         "--timezone", default="UTC", help="Timezone, e.g. Europe/Rome or UTC"
     )
@@ -130,6 +328,10 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--event-id", help="If provided, update the given event ID; otherwise create"
     )
+    parser.add_argument(
+        "--events-file",
+        help="JSON array of events (title, start, end, ...) to upsert in batches",
+    )
 
     # Backward-compatible alias
     parser.add_argument("--summary", help="Alias of --title")
@@ -142,6 +344,28 @@ def main() -> None:
     token_path = Path(args.token_file)
     token_path.parent.mkdir(parents=True, exist_ok=True)
 
+    if args.events_file:
+        payloads = load_events_file(args.events_file, args.timezone)
+        results = upsert_events_bulk(
+            client_secrets=args.client_secrets,
+            token_file=args.token_file,
+            calendar_id=args.calendar_id,
+            payloads=payloads,
+        )
+        failed = 0
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"ERROR event #{i}: {result}")
+            else:
+                print(f"OK event_id={result.get('id', '<unknown>')}")
+        if failed:
+            raise SystemExit(f"{failed} of {len(results)} events failed")
+        return
+
+    if not args.start or not args.end:
+        raise SystemExit("--start and --end are required (or provide --events-file)")
+
     # Resolve unified + alias args
     title = args.title or args.summary
     if not title:
@@ -1,14 +1,28 @@
+from __future__ import annotations
+
 import argparse
+import asyncio
+import json
+import os
+import re
 import sys
-from datetime import datetime
-from typing import Optional, Dict, Any
+import threading
+from datetime import timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Set
 
-import requests
-import msal
 import webbrowser
-from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlparse, parse_qs
 
+if TYPE_CHECKING:
+    import msal
+    import requests
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
 
 GRAPH_SCOPES = [
     "Calendars.ReadWrite",
@@ -16,6 +30,29 @@ GRAPH_SCOPES = [
     "User.Read",
 ]
 
+# Shape of the ISO 8601 datetimes accepted for --start/--end
+_ISO_RE = re.compile(
+    r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})?", re.ASCII
+)
+
+# Seconds to wait for the browser to hit the auth code redirect URI
+AUTH_CODE_TIMEOUT = 300
+# Seconds a callback connection may take to send its request headers
+CALLBACK_READ_TIMEOUT = 5
+
+# Refresh access tokens this long before they expire
+REFRESH_MARGIN = timedelta(minutes=5)
+# Delay before retrying a failed background refresh
+REFRESH_RETRY_DELAY = timedelta(minutes=1)
+# Serializes MSAL token cache reads/refreshes/writes across threads
+_REFRESH_LOCK = threading.RLock()
+# Token cache paths (or in-memory caches) that already have a refresh timer
+_REFRESH_SCHEDULED: Set[Any] = set()
+
+# Shared session so consecutive Graph calls reuse the same TLS connection;
+# created on first use by get_session()
+_SESSION: Optional[requests.Session] = None
+
 
 def build_event_payload(
     subject: str,
@@ -38,11 +75,11 @@ def build_event_payload(
 
     # Validate inputs early to fail fast with clear messages
     for label, value in (("start", start), ("end", end)):
-        try:
-            # Only validate format; Graph accepts strings with timezone separate
-            datetime.fromisoformat(value)
-        except ValueError as err:
-            raise SystemExit(f"Invalid {label} datetime '{value}': {err}")
+        # Only validate format; Graph accepts strings with timezone separate
+        if not _ISO_RE.fullmatch(value):
+            raise SystemExit(
+                f"Invalid {label} datetime '{value}': expected YYYY-MM-DDTHH:MM:SS"
+            )
 
     event: Dict[str, Any] = {
         "subject": subject,
@@ -58,18 +95,230 @@ def build_event_payload(
     return event
 
 
-def acquire_token_device_code(tenant_id: str, client_id: str) -> Dict[str, Any]:
+def get_session() -> requests.Session:
+    global _SESSION
+    if _SESSION is None:
+        # Imported lazily so --help and argument errors don't pay the import cost
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        session.headers.update({"Accept-Encoding": "gzip"})
+        # Retry keeps urllib3's default allowed_methods, so non-idempotent
+        # POST/PATCH calls are never replayed
+        session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=16,
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=0.3,
+                    status_forcelist=[429, 500, 502, 503, 504],
+                ),
+            ),
+        )
+        _SESSION = session
+    return _SESSION
+
+
+def load_token_cache(token_cache_path: Optional[Path]) -> msal.SerializableTokenCache:
+    import msal
+
+    cache = msal.SerializableTokenCache()
+    # Under the lock so we never read a file save_token_cache is replacing
+    with _REFRESH_LOCK:
+        if token_cache_path and token_cache_path.exists():
+            cache.deserialize(token_cache_path.read_text())
+    return cache
+
+
+def save_token_cache(
+    cache: msal.SerializableTokenCache, token_cache_path: Optional[Path]
+) -> None:
+    # Only touch the disk when MSAL actually added or refreshed tokens
+    with _REFRESH_LOCK:
+        if token_cache_path and cache.has_state_changed:
+            # Write then rename, so other processes never see a partial file
+            tmp_path = token_cache_path.with_name(token_cache_path.name + ".tmp")
+            # The cache holds refresh tokens: keep it readable by the owner only
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                # A stale temp file from a crash may have been created wider
+                os.chmod(tmp_path, 0o600)
+                f.write(cache.serialize())
+            os.replace(tmp_path, token_cache_path)
+
+
+def acquire_token_silent(
+    app: msal.ClientApplication, scopes: List[str]
+) -> Optional[Dict[str, Any]]:
+    """Return a cached (or silently refreshed) token for the first cached account."""
+
+    with _REFRESH_LOCK:
+        accounts = app.get_accounts()
+        if not accounts:
+            return None
+        result = app.acquire_token_silent(scopes, account=accounts[0])
+    if result and "access_token" in result:
+        return result
+    return None
+
+
+def start_background_refresh(
+    app: msal.ClientApplication,
+    scopes: List[str],
+    token_cache_path: Optional[Path],
+    token_result: Dict[str, Any],
+) -> None:
+    """Refresh the cached token from a daemon timer before it expires.
+
+    Uses the refresh token in app's cache, REFRESH_MARGIN before the current
+    token's expires_in, then persists the cache and reschedules. At most one
+    timer is started per token cache path, or per in-memory cache without one.
+    """
+
+    key = token_cache_path if token_cache_path is not None else app.token_cache
+    with _REFRESH_LOCK:
+        if key in _REFRESH_SCHEDULED:
+            return
+        _REFRESH_SCHEDULED.add(key)
+
+    def refresh() -> None:
+        try:
+            with _REFRESH_LOCK:
+                accounts = app.get_accounts()
+                result = (
+                    app.acquire_token_silent(
+                        scopes, account=accounts[0], force_refresh=True
+                    )
+                    if accounts
+                    else None
+                )
+                save_token_cache(app.token_cache, token_cache_path)
+        except Exception as err:
+            # Network errors and the like must not kill the timer chain
+            print(f"Background token refresh failed: {err}", file=sys.stderr)
+            schedule(REFRESH_RETRY_DELAY.total_seconds())
+            return
+        if result and "access_token" in result:
+            schedule_before_expiry(result)
+        elif accounts:
+            print(f"Background token refresh failed: {result}", file=sys.stderr)
+            schedule(REFRESH_RETRY_DELAY.total_seconds())
+        else:
+            # Nothing left to refresh; let a later sign-in start a new timer
+            stop()
+
+    def stop() -> None:
+        with _REFRESH_LOCK:
+            _REFRESH_SCHEDULED.discard(key)
+
+    def schedule(delay: float) -> None:
+        timer = threading.Timer(delay, refresh)
+        timer.daemon = True
+        timer.start()
+
+    def schedule_before_expiry(result: Dict[str, Any]) -> None:
+        expires_in = float(result.get("expires_in", 0))
+        schedule(max(expires_in - REFRESH_MARGIN.total_seconds(), 0))
+
+    schedule_before_expiry(token_result)
+
+
+def build_app(
+    tenant_id: str,
+    client_id: str,
+    client_secret: Optional[str],
+    cache: msal.SerializableTokenCache,
+) -> msal.ClientApplication:
+    # Confidential client when a secret is given, public (device code) otherwise
+    import msal
+
+    authority = f"https://login.microsoftonline.com/{tenant_id}"
+    if client_secret:
+        return msal.ConfidentialClientApplication(
+            client_id=client_id,
+            client_credential=client_secret,
+            authority=authority,
+            token_cache=cache,
+        )
+    return msal.PublicClientApplication(
+        client_id=client_id, authority=authority, token_cache=cache
+    )
+
+
+def _invalidate_token_cache(cache: msal.SerializableTokenCache) -> None:
+    # Drop cached access tokens so the next silent call must use the refresh token
+    import msal
+
+    with _REFRESH_LOCK:
+        for at in list(cache.search(msal.TokenCache.CredentialType.ACCESS_TOKEN)):
+            cache.remove_at(at)
+
+
+def acquire_token_silent_or_refresh(
+    tenant_id: str,
+    client_id: str,
+    client_secret: Optional[str],
+    cache: msal.SerializableTokenCache,
+    token_cache_path: Optional[Path],
+) -> Optional[Dict[str, Any]]:
+    """Discard the cached access token and redeem the refresh token silently.
+
+    cache should be the one the token was acquired with, so this also works
+    without a token_cache_path. Returns None when no account or valid refresh
+    token is cached.
+    """
+
+    app = build_app(tenant_id, client_id, client_secret, cache)
+    _invalidate_token_cache(cache)
+    scopes = [f"https://graph.microsoft.com/{s}" for s in GRAPH_SCOPES]
+    result = acquire_token_silent(app, scopes)
+    save_token_cache(cache, token_cache_path)
+    return result
+
+
+def token_ready(
+    app: msal.ClientApplication,
+    scopes: List[str],
+    token_cache_path: Optional[Path],
+    result: Dict[str, Any],
+    background_refresh: bool,
+) -> Dict[str, Any]:
+    # Common tail of the acquire_token_* flows once a token is obtained
+    save_token_cache(app.token_cache, token_cache_path)
+    if background_refresh:
+        start_background_refresh(app, scopes, token_cache_path, result)
+    return result
+
+
+def acquire_token_device_code(
+    tenant_id: str,
+    client_id: str,
+    token_cache_path: Optional[Path] = None,
+    background_refresh: bool = False,
+    cache: Optional[msal.SerializableTokenCache] = None,
+) -> Dict[str, Any]:
     """Acquire an access token using Device Code flow.
 
+    A valid token in the on-disk cache is returned without prompting. With
+    background_refresh, the token is then kept fresh by a daemon timer.
+    An already loaded cache may be passed in place of reading token_cache_path.
     Returns the token result payload from MSAL.
     """
 
-    authority = f"https://login.microsoftonline.com/{tenant_id}"
-    app = msal.PublicClientApplication(client_id=client_id, authority=authority)
+    if cache is None:
+        cache = load_token_cache(token_cache_path)
+    app = build_app(tenant_id, client_id, None, cache)
+    scopes = [f"https://graph.microsoft.com/{s}" for s in GRAPH_SCOPES]
 
-    flow = app.initiate_device_flow(
-        scopes=[f"https://graph.microsoft.com/{s}" for s in GRAPH_SCOPES]
-    )
+    result = acquire_token_silent(app, scopes)
+    if result:
+        return token_ready(app, scopes, token_cache_path, result, background_refresh)
+
+    flow = app.initiate_device_flow(scopes=scopes)
     if "user_code" not in flow:
         raise SystemExit(f"Failed to create device flow. Details: {flow}")
 
@@ -80,25 +329,101 @@ def acquire_token_device_code(tenant_id: str, client_id: str) -> Dict[str, Any]:
         desc = result.get("error_description")
         raise SystemExit(f"Failed to acquire token: {error}: {desc}")
 
-    return result
+    return token_ready(app, scopes, token_cache_path, result, background_refresh)
+
+
+async def _wait_for_code(
+    host: str, port: int, callback_path: str, auth_url: str, timeout: float
+) -> Dict[str, List[str]]:
+    """Serve the redirect URI until it receives an auth code or an error.
+
+    Requests to other paths (e.g. /favicon.ico) get a 404 and don't end the
+    wait. Returns the parsed query string of the callback request.
+    """
+
+    result: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            # Browsers open speculative connections that never send a request
+            head = await asyncio.wait_for(
+                reader.readuntil(b"\r\n\r\n"), CALLBACK_READ_TIMEOUT
+            )
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            asyncio.TimeoutError,
+        ):
+            writer.close()
+            return
+        parts = head.split(b"\r\n", 1)[0].decode("latin-1").split(" ")
+        target = urlparse(parts[1] if len(parts) > 1 else "/")
+        query = parse_qs(target.query)
+        if target.path != callback_path:
+            status, body = "404 Not Found", b""
+        elif "code" in query or "error" in query:
+            status = "200 OK"
+            body = b"You may close this window and return to the application."
+            if not result.done():
+                result.set_result(query)
+        else:
+            status, body = "400 Bad Request", b""
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        # Only open the browser once the listener is accepting connections
+        print(f"Opening browser for consent: {auth_url}")
+        try:
+            webbrowser.open(auth_url)
+        except Exception:
+            print("Please open the URL above manually in a browser.")
+        try:
+            return await asyncio.wait_for(result, timeout)
+        except asyncio.TimeoutError:
+            raise SystemExit("Authorization code not received (timed out)")
+        finally:
+            # wait_closed() on exit waits for every open connection, including
+            # idle preconnect sockets, so drop them first
+            server.close()
+            server.close_clients()
 
 
 def acquire_token_auth_code(
-    tenant_id: str, client_id: str, client_secret: str, redirect_uri: str
+    tenant_id: str,
+    client_id: str,
+    client_secret: str,
+    redirect_uri: str,
+    token_cache_path: Optional[Path] = None,
+    background_refresh: bool = False,
+    cache: Optional[msal.SerializableTokenCache] = None,
 ) -> Dict[str, Any]:
     """Acquire an access token using Authorization Code flow for confidential clients.
 
-    Opens the system browser and listens on the redirect URI to capture the auth code.
+    A valid token in the on-disk cache is returned without opening the browser.
+    Otherwise opens the system browser and listens on the redirect URI to capture
+    the auth code. With background_refresh, the token is then kept fresh by a
+    daemon timer. An already loaded cache may be passed in place of reading
+    token_cache_path.
     """
 
-    authority = f"https://login.microsoftonline.com/{tenant_id}"
-    app = msal.ConfidentialClientApplication(
-        client_id=client_id,
-        client_credential=client_secret,
-        authority=authority,
-    )
+    if cache is None:
+        cache = load_token_cache(token_cache_path)
+    app = build_app(tenant_id, client_id, client_secret, cache)
 
     scopes = [f"https://graph.microsoft.com/{s}" for s in GRAPH_SCOPES]
+    result = acquire_token_silent(app, scopes)
+    if result:
+        return token_ready(app, scopes, token_cache_path, result, background_refresh)
+
     auth_url = app.get_authorization_request_url(
         scopes=scopes, redirect_uri=redirect_uri
     )
@@ -107,48 +432,27 @@ def acquire_token_auth_code(
     parsed = urlparse(redirect_uri)
     host = parsed.hostname or "localhost"
     port = parsed.port or 8400
-    code_holder: Dict[str, Any] = {}
-
-    class Handler(BaseHTTPRequestHandler):
-        def do_GET(self):  # type: ignore[override]
-            query = parse_qs(urlparse(self.path).query)
-            if "code" in query:
-                code_holder["code"] = query["code"][0]
-                self.send_response(200)
-                self.send_header("Content-Type", "text/plain")
-                self.end_headers()
-                self.wfile.write(
-                    b"You may close this window and return to the application."
-                )
-            else:
-                self.send_response(400)
-                self.end_headers()
-
-        def log_message(self, format, *args):  # noqa: A003 - silence server logs
-            return
-
-    httpd = HTTPServer((host, port), Handler)
-    print(f"Opening browser for consent: {auth_url}")
-    try:
-        webbrowser.open(auth_url)
-    except Exception:
-        print("Please open the URL above manually in a browser.")
-
-    # Serve a single request to capture the code
-    httpd.handle_request()
-    httpd.server_close()
+    query = asyncio.run(
+        _wait_for_code(host, port, parsed.path or "/", auth_url, AUTH_CODE_TIMEOUT)
+    )
 
-    if "code" not in code_holder:
-        raise SystemExit("Authorization code not received")
+    if "code" not in query:
+        raise SystemExit(f"Authorization code not received: {query.get('error')}")
 
     result = app.acquire_token_by_authorization_code(
-        code_holder["code"], scopes=scopes, redirect_uri=redirect_uri
+        query["code"][0], scopes=scopes, redirect_uri=redirect_uri
     )
     if "access_token" not in result:
         error = result.get("error")
         desc = result.get("error_description")
         raise SystemExit(f"Failed to acquire token via auth code: {error}: {desc}")
-    return result
+    return token_ready(app, scopes, token_cache_path, result, background_refresh)
+
+
+def encode_json(payload: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, allow_nan=False).encode("utf-8")
 
 
 def graph_request(
@@ -159,7 +463,9 @@ def graph_request(
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json",
     }
-    resp = requests.request(method=method, url=url, headers=headers, json=json)
+    # Encode the body ourselves rather than letting requests run stdlib json
+    data = encode_json(json) if json is not None else None
+    resp = get_session().request(method=method, url=url, headers=headers, data=data)
     return resp
 
 
@@ -176,17 +482,32 @@ def upsert_event(
     calendar_id: Optional[str],
     client_secret: Optional[str],
     redirect_uri: Optional[str],
+    token_cache: Optional[str] = None,
+    background_refresh: bool = False,
 ) -> Dict[str, Any]:
+    token_cache_path = Path(token_cache) if token_cache else None
+    # Kept for the 401 retry below, which must see the same tokens even when
+    # nothing is persisted to disk
+    cache = load_token_cache(token_cache_path)
+    # Device code flow uses a public client even if a secret was passed
+    app_secret = client_secret if client_secret and redirect_uri else None
     if client_secret and redirect_uri:
         token_result = acquire_token_auth_code(
             tenant_id=tenant_id,
             client_id=client_id,
             client_secret=client_secret,
             redirect_uri=redirect_uri,
+            token_cache_path=token_cache_path,
+            background_refresh=background_refresh,
+            cache=cache,
         )
     else:
         token_result = acquire_token_device_code(
-            tenant_id=tenant_id, client_id=client_id
+            tenant_id=tenant_id,
+            client_id=client_id,
+            token_cache_path=token_cache_path,
+            background_refresh=background_refresh,
+            cache=cache,
         )
     access_token = token_result["access_token"]
 
@@ -201,16 +522,26 @@ def upsert_event(
 
     if event_id:
         # Update existing event
-        resp = graph_request(
-            "PATCH", f"/me/events/{event_id}", token=access_token, json=payload
-        )
+        method, path = "PATCH", f"/me/events/{event_id}"
     else:
         # Create new event on default calendar or a specific calendar if provided
+        method = "POST"
         if calendar_id and calendar_id != "calendar":
             path = f"/me/calendars/{calendar_id}/events"
         else:
             path = "/me/calendar/events"
-        resp = graph_request("POST", path, token=access_token, json=payload)
+    resp = graph_request(method, path, token=access_token, json=payload)
+
+    if resp.status_code == 401:
+        # The cached token may have expired or been revoked server-side: drop
+        # it, redeem the refresh token and retry exactly once
+        refreshed = acquire_token_silent_or_refresh(
+            tenant_id, client_id, app_secret, cache, token_cache_path
+        )
+        if refreshed:
+            resp = graph_request(
+                method, path, token=refreshed["access_token"], json=payload
+            )
 
     if resp.status_code >= 300:
         try:
@@ -261,6 +592,11 @@ def parse_args() -> argparse.Namespace:
         "--redirect-uri",
         help="Redirect URI for auth code flow (e.g. http://localhost:8400/callback)",
     )
+    parser.add_argument(
+        "--token-cache",
+        default=str(Path.home() / ".config" / "nillebCal" / "graph_token_cache.json"),
+        help="Where to cache MSAL tokens (will be created if missing)",
+    )
 
     # Backward-compatible aliases
     parser.add_argument("--subject", help="Alias of --title")
@@ -270,6 +606,9 @@ def parse_args() -> argparse.Namespace:
 
 def main() -> None:
     args = parse_args()
+    # Ensure token cache directory exists
+    Path(args.token_cache).parent.mkdir(parents=True, exist_ok=True)
+
     # Resolve unified + alias args
     title = args.title or args.subject
     if not title:
@@ -289,6 +628,7 @@ def main() -> None:
         calendar_id=args.calendar_id,
         client_secret=args.client_secret,
         redirect_uri=args.redirect_uri,
+        token_cache=args.token_cache,
     )
 
     # Print minimal output so this can be scripted easily
@@ -1,29 +1,286 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import argparse
 import sys
 import csv
+import hashlib
 import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any, Optional
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+)
 
-import requests
 from dateutil import tz, parser as dtparser
-from icalendar import Calendar, Event
-import recurring_ical_events
+
+if TYPE_CHECKING:
+    import requests
+    from icalendar import Calendar, Event
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# Downloaded feeds and their ETag/Last-Modified validators, keyed by URL hash
+ICS_CACHE_DIR = Path.home() / ".cache" / "ics_reader"
+# Widen the prefilter window so floating/TZID times, compared as naive UTC,
+# are never dropped because of their UTC offset
+PREFILTER_SLACK = timedelta(days=1)
+# Serialize in worker processes only when the pool startup cost pays off.
+# The parent still pickles every Event for the workers, which costs about as
+# much as serializing it inline, so this only wins on several cores with
+# large outputs
+PARALLEL_THRESHOLD = 20000
+PARALLEL_CHUNKSIZE = 256
+# Properties that make an event's occurrences depend on recurrence expansion
+RECURRENCE_PROPS = ("RRULE", "RDATE", "EXDATE", "RECURRENCE-ID")
+# VEVENT properties needed for expansion and output; the rest are dropped
+VEVENT_PROPS = frozenset(
+    (
+        "UID",
+        "DTSTART",
+        "DTEND",
+        "DURATION",
+        "SEQUENCE",
+        "SUMMARY",
+        "DESCRIPTION",
+        "LOCATION",
+        "ORGANIZER",
+        "ATTENDEE",
+        "STATUS",
+        "TRANSP",
+        "CATEGORIES",
+        "CLASS",
+    )
+    + RECURRENCE_PROPS
+)
+# One content line: NAME, optional ;PARAMS (values may be quoted), VALUE
+PROP_RE = re.compile(r'([A-Za-z0-9-]+)((?:;(?:[^:"\r\n]|"[^"]*")*)?):(.*?)\r?')
+
+# Shared session so repeated feed downloads reuse the TLS connection;
+# created on first use by get_ics_session()
+_ICS_SESSION: Optional[requests.Session] = None
+
+
+def get_ics_session() -> requests.Session:
+    global _ICS_SESSION
+    if _ICS_SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        session.mount("https://", HTTPAdapter(pool_maxsize=4))
+        session.mount("http://", HTTPAdapter(pool_maxsize=4))
+        _ICS_SESSION = session
+    return _ICS_SESSION
 
 
-def load_ics(source: str) -> bytes:
+def load_ics(source: str, use_cache: bool = True) -> bytes:
     # Fetch ICS from URL or read from local file
     if source.lower().startswith(("http://", "https://")):
-        resp = requests.get(source, timeout=30)
-        resp.raise_for_status()
-        return resp.content
+        return fetch_ics(source, use_cache)
     else:
         with open(source, "rb") as f:
             return f.read()
 
 
+def fetch_ics(url: str, use_cache: bool = True) -> bytes:
+    """Download an ICS feed, revalidating a cached copy with ETag/Last-Modified.
+
+    On HTTP 304 the cached body is returned without downloading the feed again.
+    """
+
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    meta_path = ICS_CACHE_DIR / f"{key}.meta"
+    body_path = ICS_CACHE_DIR / f"{key}.ics"
+
+    headers: Dict[str, str] = {}
+    if use_cache and meta_path.exists() and body_path.exists():
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (OSError, ValueError):
+            # Truncated or corrupt metadata: treat as a cache miss
+            meta = {}
+        if not isinstance(meta, dict):
+            meta = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    resp = get_ics_session().get(url, timeout=30, headers=headers)
+    if resp.status_code == 304 and body_path.exists():
+        return body_path.read_bytes()
+    resp.raise_for_status()
+
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    if use_cache and (etag or last_modified):
+        ICS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # resp.content is already decompressed, so cache hits skip inflating.
+        # Body first: a crash in between then leaves old validators that no
+        # longer match, which only costs a full download next time
+        write_atomic(body_path, resp.content)
+        meta = {"etag": etag, "last_modified": last_modified}
+        write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+    return resp.content
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    # Write then rename, so readers never see a partially written file
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def unfold_ics(raw: bytes) -> str:
+    # RFC 5545 3.1: a CRLF followed by a space or tab continues the previous line
+    # utf-8-sig drops a leading byte order mark that would hide BEGIN:VCALENDAR
+    text = raw.decode("utf-8-sig", errors="replace")
+    return re.sub(r"\r?\n[ \t]", "", text)
+
+
+def iter_properties(raw: bytes) -> Iterator[Tuple[str, str, str]]:
+    """Yield ``(NAME, line, value)`` for each content line of an ICS feed.
+
+    Lines that don't look like a property are yielded with an empty NAME so
+    callers can decide whether to pass them on to icalendar.
+    """
+
+    fullmatch = PROP_RE.fullmatch
+    for line in unfold_ics(raw).split("\n"):
+        m = fullmatch(line)
+        if m is None:
+            if line.strip():
+                yield "", line.rstrip("\r"), ""
+            continue
+        name, params, value = m.group(1, 2, 3)
+        yield name.upper(), f"{name}{params}:{value}", value
+
+
+def parse_ics_datetime(value: str) -> Optional[datetime]:
+    # Cheap naive parse of DATE / DATE-TIME values; None if not recognised
+    value = value.rstrip("Z")
+    try:
+        if len(value) == 8:
+            return datetime.strptime(value, "%Y%m%d")
+        if len(value) == 15:
+            return datetime.strptime(value, "%Y%m%dT%H%M%S")
+    except ValueError:
+        pass
+    return None
+
+
+def vevent_in_range(props: Dict[str, str], start: datetime, end: datetime) -> bool:
+    """Whether a VEVENT may have occurrences overlapping [start, end].
+
+    Works on the raw property values so that events that cannot overlap the
+    window, including recurring events whose RRULE UNTIL is past or whose
+    DTSTART is after the window, are never handed to icalendar or the
+    recurrence engine. Errs on the side of keeping the event.
+    """
+
+    # Overrides and explicit extra dates can move occurrences anywhere
+    if "RECURRENCE-ID" in props or "RDATE" in props:
+        return True
+
+    dtstart = parse_ics_datetime(props.get("DTSTART", ""))
+    if dtstart is None:
+        return True
+    window_start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    window_end = end.astimezone(timezone.utc).replace(tzinfo=None)
+    # No occurrence of an RRULE starts before DTSTART
+    if dtstart >= window_end + PREFILTER_SLACK:
+        return False
+
+    if "DTEND" in props:
+        dtend = parse_ics_datetime(props["DTEND"])
+        length = dtend - dtstart if dtend is not None else None
+    elif "DURATION" in props:
+        length = None
+    else:
+        # No DTEND/DURATION: all-day events last one day, others are instants
+        all_day = len(props["DTSTART"].rstrip("Z")) == 8
+        length = timedelta(days=1) if all_day else timedelta(0)
+    if length is None or length < timedelta(0):
+        return True
+
+    if "RRULE" in props:
+        last_start = rrule_until(props["RRULE"])
+        if last_start is None:
+            return True
+    else:
+        last_start = dtstart
+    return last_start + length >= window_start - PREFILTER_SLACK
+
+
+def rrule_until(rrule: str) -> Optional[datetime]:
+    # Latest possible occurrence start from an RRULE's UNTIL, None if unbounded
+    for part in rrule.split(";"):
+        key, _, value = part.partition("=")
+        if key.upper() == "UNTIL":
+            until = parse_ics_datetime(value)
+            if until is not None and len(value.rstrip("Z")) == 8:
+                # A DATE UNTIL still allows occurrences during that day
+                until += timedelta(days=1)
+            return until
+    return None
+
+
+def load_calendar(ics_bytes: bytes, start: datetime, end: datetime) -> Calendar:
+    """Parse the feed, keeping only VEVENTs that may overlap [start, end].
+
+    Inside VEVENTs only VEVENT_PROPS are kept and subcomponents such as VALARM
+    are dropped, so icalendar never builds objects for data we don't output.
+    Everything outside VEVENTs (calendar properties, VTIMEZONE) is kept,
+    including lines we can't parse, so icalendar sees them unchanged.
+    """
+
+    from icalendar import Calendar
+
+    kept: List[str] = []
+    block: Optional[List[str]] = None
+    props: Dict[str, str] = {}
+    depth = 0  # nesting level of subcomponents inside the current VEVENT
+    for name, line, value in iter_properties(ics_bytes):
+        if block is None:
+            if name == "BEGIN" and value.strip().upper() == "VEVENT":
+                block, props, depth = [line], {}, 0
+            else:
+                kept.append(line)
+        elif name == "BEGIN":
+            depth += 1
+        elif name == "END":
+            if depth:
+                depth -= 1
+                continue
+            block.append(line)
+            if vevent_in_range(props, start, end):
+                kept.extend(block)
+            block = None
+        elif not depth and name in VEVENT_PROPS:
+            block.append(line)
+            props.setdefault(name, value)
+    return Calendar.from_ical("\r\n".join(kept))
+
+
 def ensure_timezone(dt, default_tz: tz.tzoffset) -> datetime:
     # Convert naive datetimes to default timezone, keep aware ones as-is
     if isinstance(dt, datetime):
@@ -36,58 +293,110 @@ def ensure_timezone(dt, default_tz: tz.tzoffset) -> datetime:
     return dt
 
 
-def normalize_to_tz(dt: datetime, target_tz: tz.tzoffset) -> datetime:
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(target_tz)
+@lru_cache(maxsize=None)
+def get_tz(name: str) -> Optional[tz.tzfile]:
+    return tz.gettz(name)
+
+
+def make_converter(
+    default_tz: tz.tzoffset, target_tz: tz.tzoffset
+) -> Callable[[Any], Tuple[datetime, bool]]:
+    """Build a DTSTART/DTEND value converter bound to the given timezones.
+
+    The returned callable maps a date or datetime to ``(aware datetime in
+    target_tz, all_day)``: naive datetimes are assumed to be in default_tz and
+    dates become midnight in default_tz.
+    """
+
+    def to_target(dt: Any) -> Tuple[datetime, bool]:
+        if isinstance(dt, datetime):
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=default_tz)
+            return dt.astimezone(target_tz), False
+        # date instance => all-day
+        midnight = datetime(dt.year, dt.month, dt.day, tzinfo=default_tz)
+        return midnight.astimezone(target_tz), True
+
+    return to_target
+
+
+def event_in_range(evt: Event, start: datetime, end: datetime) -> bool:
+    # Same overlap rule as recurring_ical_events, which reads floating times
+    # and dates in the timezone of the requested window
+    span_tz = start.tzinfo
+    dtstart = evt["DTSTART"].dt
+    all_day = not isinstance(dtstart, datetime)
+    dtstart = ensure_timezone(dtstart, span_tz)
+    if "DTEND" in evt:
+        dtend = ensure_timezone(evt["DTEND"].dt, span_tz)
+    elif "DURATION" in evt:
+        dtend = dtstart + evt["DURATION"].dt
+    else:
+        dtend = dtstart + (timedelta(days=1) if all_day else timedelta(0))
+    return dtstart < end and (dtend > start or dtstart >= start)
 
 
 def expand_events(
     cal: Calendar, start: datetime, end: datetime, default_tz: tz.tzoffset
 ) -> List[Event]:
-    # recurring_ical_events handles RRULE/EXDATE/RECURRENCE-ID expansion
-    events = recurring_ical_events.of(cal).between(start, end)
-    # Also include non-recurring events that fall in range (library should cover this, but be explicit)
+    import recurring_ical_events
+    from icalendar import Calendar
+
+    # Only events with recurrence properties need the recurrence engine;
+    # one-shot events are range-checked directly. With X-WR-TIMEZONE the
+    # library also rewrites every event's times into that zone, so it must
+    # see all events.
+    shortcut = "X-WR-TIMEZONE" not in cal
+    simple: List[Event] = []
+    recurring: List[Event] = []
+    for evt in cal.walk("VEVENT"):
+        if (
+            shortcut
+            and "DTSTART" in evt
+            and not any(p in evt for p in RECURRENCE_PROPS)
+        ):
+            simple.append(evt)
+        else:
+            recurring.append(evt)
+
+    events = [e for e in simple if event_in_range(e, start, end)]
+    if recurring:
+        # recurring_ical_events handles RRULE/EXDATE/RECURRENCE-ID expansion;
+        # keep calendar properties and VTIMEZONEs so TZIDs still resolve
+        recurring_cal = Calendar(cal)
+        recurring_cal.subcomponents = [
+            c for c in cal.subcomponents if c.name != "VEVENT"
+        ] + recurring
+        events.extend(recurring_ical_events.of(recurring_cal).between(start, end))
     return events
 
 
+def _s(value: Any) -> str:
+    return "" if value is None else str(value)
+
+
 def serialize_event(
-    evt: Event, target_tz: tz.tzoffset, default_tz: tz.tzoffset
+    evt: Event, to_target: Callable[[Any], Tuple[datetime, bool]]
 ) -> Dict[str, Any]:
-    def get_prop(name: str):
-        return evt.get(name)
-
-    uid = str(get_prop("UID") or "")
-    summary = str(get_prop("SUMMARY") or "")
-    description = str(get_prop("DESCRIPTION") or "")
-    location = str(get_prop("LOCATION") or "")
-    organizer = str(get_prop("ORGANIZER") or "")
+    get = evt.get
 
-    dtstart = get_prop("DTSTART").dt if get_prop("DTSTART") else None
-    dtend = get_prop("DTEND").dt if get_prop("DTEND") else None
+    start_prop = get("DTSTART")
+    end_prop = get("DTEND")
+    dtstart = start_prop.dt if start_prop is not None else None
+    dtend = end_prop.dt if end_prop is not None else None
     all_day = False
 
     # Convert naive -> default_tz, then to target_tz
     if dtstart is not None:
-        if not isinstance(dtstart, datetime):
-            # date instance => all-day
-            all_day = True
-            dtstart = ensure_timezone(dtstart, default_tz)
-        else:
-            dtstart = ensure_timezone(dtstart, default_tz)
-        dtstart = normalize_to_tz(dtstart, target_tz)
+        dtstart, all_day = to_target(dtstart)
 
     if dtend is not None:
-        if not isinstance(dtend, datetime):
-            all_day = True
-            dtend = ensure_timezone(dtend, default_tz)
-        else:
-            dtend = ensure_timezone(dtend, default_tz)
-        dtend = normalize_to_tz(dtend, target_tz)
+        dtend, end_all_day = to_target(dtend)
+        all_day = all_day or end_all_day
 
     # Some feeds omit DTEND for all-day events; infer using DURATION or +1 day rule
     if dtstart and not dtend:
-        duration = get_prop("DURATION")
+        duration = get("DURATION")
         if duration:
             dtend = dtstart + duration.dt
         else:
@@ -95,39 +404,87 @@ def serialize_event(
             dtend = dtstart + (timedelta(days=1) if all_day else timedelta(minutes=0))
 
     # Attendees (optional)
-    attendees = []
-    if "ATTENDEE" in evt:
-        raw = evt.get("ATTENDEE")
-        if isinstance(raw, list):
-            attendees.extend([str(x) for x in raw])
-        else:
-            attendees.append(str(raw))
+    raw = get("ATTENDEE")
+    if isinstance(raw, list):
+        attendees = [str(x) for x in raw]
+    else:
+        attendees = [str(raw)] if raw is not None else []
 
-    transparency = str(get_prop("TRANSP") or "")
-    status = str(get_prop("STATUS") or "")
-    categories = get_prop("CATEGORIES")
-    if isinstance(categories, list):
-        categories = [str(c) for c in categories]
-    elif categories is not None:
-        categories = [str(categories)]
+    # Each CATEGORIES line is a vCategory holding one or more values
+    categories = get("CATEGORIES")
+    if categories is not None:
+        lines = categories if isinstance(categories, list) else [categories]
+        categories = [str(c) for line in lines for c in getattr(line, "cats", [line])]
 
     return {
-        "uid": uid,
-        "summary": summary,
-        "description": description,
-        "location": location,
-        "organizer": organizer,
+        "uid": _s(get("UID")),
+        "summary": _s(get("SUMMARY")),
+        "description": _s(get("DESCRIPTION")),
+        "location": _s(get("LOCATION")),
+        "organizer": _s(get("ORGANIZER")),
         "start": dtstart.isoformat() if dtstart else None,
         "end": dtend.isoformat() if dtend else None,
         "all_day": all_day,
-        "status": status,
-        "transparency": transparency,
+        "status": _s(get("STATUS")),
+        "transparency": _s(get("TRANSP")),
         "categories": categories,
-        "raw_class": str(get_prop("CLASS") or ""),
+        "raw_class": _s(get("CLASS")),
         "attendees": attendees,
     }
 
 
+def serialize_event_by_tz_name(
+    evt: Event, target_tz_name: str, default_tz_name: str
+) -> Dict[str, Any]:
+    # Process pool entry point: tzinfo objects are rebuilt from their names
+    # in each worker rather than pickled
+    to_target = make_converter(get_tz(default_tz_name), get_tz(target_tz_name))
+    return serialize_event(evt, to_target)
+
+
+CSV_FIELDNAMES = [
+    "uid",
+    "summary",
+    "description",
+    "location",
+    "organizer",
+    "start",
+    "end",
+    "all_day",
+    "status",
+    "transparency",
+    "categories",
+    "raw_class",
+    "attendees",
+]
+
+
+def dumps_row(row: Dict[str, Any]) -> str:
+    if orjson is not None:
+        return orjson.dumps(row, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(row, ensure_ascii=False)
+
+
+def write_json(rows: Iterable[Dict[str, Any]], out: TextIO) -> None:
+    # Emit a JSON array one row at a time instead of building it in memory
+    sep = "[\n"
+    for row in rows:
+        out.write(sep + dumps_row(row))
+        sep = ",\n"
+    out.write("[]\n" if sep == "[\n" else "\n]\n")
+
+
+def write_csv(rows: Iterable[Dict[str, Any]], out: TextIO) -> None:
+    w = csv.DictWriter(out, fieldnames=CSV_FIELDNAMES)
+    w.writeheader()
+    for r in rows:
+        # Flatten list fields for CSV
+        for key in ("categories", "attendees"):
+            if isinstance(r.get(key), list):
+                r[key] = ";".join(r[key])
+        w.writerow(r)
+
+
 def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     p = argparse.ArgumentParser(
         description="Read and expand events from an ICS feed (URL or file)."
@@ -160,14 +517,20 @@ def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     p.add_argument(
         "--limit", type=int, default=0, help="Limit number of events (0 = no limit)"
     )
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always download URL feeds, ignoring the local ETag cache",
+    )
     return p.parse_args(argv)
 
 
 def main(argv: Optional[List[str]] = None) -> int:
     args = parse_args(argv)
 
-    target_tz = tz.gettz(args.tz)
-    default_tz = tz.gettz(args.default_tz)
+    target_tz = get_tz(args.tz)
+    default_tz = get_tz(args.default_tz)
+    to_target = make_converter(default_tz, target_tz)
 
     now = datetime.now(timezone.utc)
     start = (
@@ -181,44 +544,26 @@ def main(argv: Optional[List[str]] = None) -> int:
         else (now + timedelta(days=90))
     )
 
-    ics_bytes = load_ics(args.source)
-    cal = Calendar.from_ical(ics_bytes)
+    ics_bytes = load_ics(args.source, use_cache=not args.no_cache)
+    cal = load_calendar(ics_bytes, start, end)
 
     events = expand_events(cal, start, end, default_tz)
 
-    rows = []
-    for e in events:
-        rows.append(serialize_event(e, target_tz, default_tz))
-
     if args.limit and args.limit > 0:
-        rows = rows[: args.limit]
-
-    if args.output == "json":
-        print(json.dumps(rows, indent=2, ensure_ascii=False))
+        events = events[: args.limit]
+    write = write_json if args.output == "json" else write_csv
+
+    workers = os.process_cpu_count() or 1
+    if workers > 1 and len(events) > PARALLEL_THRESHOLD:
+        worker = partial(
+            serialize_event_by_tz_name,
+            target_tz_name=args.tz,
+            default_tz_name=args.default_tz,
+        )
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            write(pool.map(worker, events, chunksize=PARALLEL_CHUNKSIZE), sys.stdout)
     else:
-        # CSV
-        fieldnames = [
-            "uid",
-            "summary",
-            "description",
-            "location",
-            "organizer",
-            "start",
-            "end",
-            "all_day",
-            "status",
-            "transparency",
-            "categories",
-            "raw_class",
-        ]
-        w = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-        w.writeheader()
-        for r in rows:
-            # Flatten categories for CSV
-            r = dict(r)
-            if isinstance(r.get("categories"), list):
-                r["categories"] = ";".join(r["categories"])
-            w.writerow(r)
+        write((serialize_event(e, to_target) for e in events), sys.stdout)
 
     return 0
 